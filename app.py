@@ -1,11 +1,13 @@
+import io
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 import numpy as np
 from datetime import datetime
-import calendar
 import warnings
 from database import init_db, add_user, verify_user
+from downsampling import lttb_indices
 
 # Handle dependencies
 try:
@@ -34,13 +36,16 @@ def set_custom_style():
         </style>
     """, unsafe_allow_html=True)
 
+def theme_controls():
+    """Sidebar dark-mode toggle and the matching page style, shared by every page."""
+    # Streamlit clears elements a rerun does not emit, so the style is written on every run.
+    st.session_state.setdefault('dark_mode', False)
+    st.sidebar.checkbox("Dark Mode", key="dark_mode")
+    set_custom_style()
+
 def login_page():
     # Allow users to choose dark mode on the login page.
-    if 'dark_mode' not in st.session_state:
-        st.session_state.dark_mode = False
-    st.sidebar.checkbox("Dark Mode", value=st.session_state.dark_mode, key="dark_mode")
-
-    set_custom_style()
+    theme_controls()
     st.markdown('<h1 style="text-align: center;">AI-Powered Data Visualizer</h1>', unsafe_allow_html=True)
 
     with st.container():
@@ -71,36 +76,170 @@ def login_page():
                         else:
                             st.error("Username already exists. Please choose a different username.")
 
+# Line charts are reduced to this many points before being sent to the browser.
+LINE_PLOT_MAX_POINTS = 2000
+# Per-point markers and SVG rendering are only used on short series; longer ones use WebGL.
+MARKER_MAX_POINTS = 500
+
+# Numeric distributions are binned server-side into this many bars.
+HISTOGRAM_BINS = 30
+
+# Scatter plots draw at most this many rows, sampled from larger datasets.
+SCATTER_MAX_POINTS = 50000
+
+# Rows sampled when estimating how repetitive a text column is.
+CARDINALITY_SAMPLE_SIZE = 1000
+
+# Prepared datasets kept in memory across reruns and sessions.
+DATASET_CACHE_ENTRIES = 8
+
+# Uploads larger than this get a quick preview and wait for the user before full analysis.
+LARGE_FILE_BYTES = 50 * 1024 * 1024
+PREVIEW_ROWS = 10
+# Bytes read from the start of a large upload to build its preview.
+PREVIEW_BYTES = 1024 * 1024
+
+# Formats tried on a column sample, in order; the first that parses the whole sample wins.
+DATE_FORMATS = [
+    '%Y-%m-%d', '%d-%m-%Y', '%m/%d/%Y',
+    '%Y-%m-%d %H:%M:%S', '%d-%b-%y', '%Y%m%d'
+]
+
+# Shapes of DATE_FORMATS, each with a year component so scores ("2-1") or fractions ("1/2") never match.
+DATE_LIKE_PATTERN = (r'^\d{4}-\d{1,2}-\d{1,2}|^\d{1,2}-\d{1,2}-\d{4}|^\d{1,2}/\d{1,2}/\d{4}'
+                     r'|^\d{1,2}-[A-Za-z]{3}-\d{2}$|^\d{8}$')
+
 def smart_datetime_conversion(df):
-    """Convert columns to datetime using common format detection."""
-    date_formats = [
-        '%Y-%m-%d', '%d-%m-%Y', '%m/%d/%Y',
-        '%Y-%m-%d %H:%M:%S', '%d-%b-%y', '%Y%m%d'
-    ]
+    """Convert columns to datetime, choosing the format from a small sample before a full parse."""
+    # Pick candidate columns from the dtypes alone; select_dtypes would copy them into a new frame.
+    text_cols = [col for col, dtype in df.dtypes.items() if pd.api.types.is_string_dtype(dtype)]
+    for col in text_cols:
+        # Cheap check on the first few non-null values so free-text columns are never parsed.
+        # Slicing before dropna keeps this independent of the column length.
+        sample = df[col].iloc[:100].dropna()
+        if sample.empty:
+            # Only a column with an empty head pays for the full scan.
+            sample = df[col].dropna()
+        sample = sample.iloc[:5].astype(str)
+        if sample.empty or not sample.str.match(DATE_LIKE_PATTERN).all():
+            continue
 
-    for col in df.select_dtypes(include='object'):
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
-            for fmt in date_formats:
+            for fmt in DATE_FORMATS:
                 try:
-                    df[col] = pd.to_datetime(df[col], format=fmt, errors='raise')
-                    break
+                    pd.to_datetime(sample, format=fmt, errors='raise')
                 except (ValueError, TypeError):
                     continue
+                # cache=True parses each distinct string once, which pays off on repetitive logs.
+                parsed = pd.to_datetime(df[col], format=fmt, errors='coerce', cache=True)
+                # Like the strict parse this replaces, convert only when every value fits the format.
+                if parsed.notna().sum() == df[col].notna().sum():
+                    df[col] = parsed
+                    break
+    return df
+
+def compact_text_columns(df):
+    """Store repetitive text columns as categoricals and the rest as Arrow-backed strings."""
+    if df.empty:
+        return df
+    for col, dtype in df.dtypes.items():
+        if not pd.api.types.is_string_dtype(dtype):
+            continue
+        # A leading sample is enough to judge cardinality; slice before dropna so nothing scans the whole column.
+        sample = df[col].iloc[:CARDINALITY_SAMPLE_SIZE].dropna()
+        if sample.nunique() / max(len(sample), 1) < 0.5:
+            df[col] = df[col].astype('category')
+        else:
+            # Arrow strings are compact and reach Streamlit's Arrow serializer without conversion.
+            df[col] = df[col].astype('string[pyarrow]')
     return df
 
-def generate_ai_narrative(df):
+def read_csv_bytes(data):
+    """Read CSV bytes with the multi-threaded Arrow reader, which also types ISO timestamps."""
+    try:
+        df = pd.read_csv(io.BytesIO(data), engine='pyarrow')
+    except pd.errors.ParserError:
+        # Arrow rejects short rows that the C reader pads with missing values.
+        return pd.read_csv(io.BytesIO(data))
+    if df.columns.has_duplicates or (df.columns == '').any():
+        # Arrow keeps repeated and blank headers as-is; the C reader names them name.1 and Unnamed: N.
+        df = pd.read_csv(io.BytesIO(data))
+    return df
+
+# The dataset caches below are keyed on the upload's file_id; the underscore-prefixed arguments
+# are skipped by Streamlit's hasher, so a cache hit never scans the file or the frame.
+# cache_resource hands back the cached frame itself; cache_data would unpickle a full copy on
+# every rerun. Callers must therefore treat the returned frame as read-only.
+@st.cache_resource(show_spinner="Parsing CSV...", max_entries=DATASET_CACHE_ENTRIES)
+def load_and_prepare(dataset_key, _uploaded_file):
+    """Parse the uploaded CSV and convert its datetime columns, cached per upload."""
+    df = smart_datetime_conversion(read_csv_bytes(_uploaded_file.getvalue()))
+    return compact_text_columns(df)
+
+def classify_columns(df):
+    """Map every column to 'numeric', 'datetime' or 'categorical' from its dtype alone."""
+    column_types = {}
+    for col, dtype in df.dtypes.items():
+        if pd.api.types.is_bool_dtype(dtype):
+            column_types[col] = 'categorical'
+        elif pd.api.types.is_numeric_dtype(dtype):
+            column_types[col] = 'numeric'
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            column_types[col] = 'datetime'
+        else:
+            column_types[col] = 'categorical'
+    return column_types
+
+@st.cache_data(show_spinner=False)
+def correlation_matrix(dataset_key, _df, numeric_cols):
+    """Absolute correlation matrix of the numeric columns, computed once per dataset."""
+    df = _df
+    values = df[numeric_cols].to_numpy(dtype=float, na_value=np.nan)
+    if np.isnan(values).any():
+        # pandas drops missing values pair by pair, which np.corrcoef cannot do.
+        return df[numeric_cols].corr().abs()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = np.corrcoef(values, rowvar=False)
+    return pd.DataFrame(np.abs(corr), index=numeric_cols, columns=numeric_cols)
+
+def top_correlated_pairs(corr, n=3):
+    """Return the n strongest (column, column, coefficient) pairs from the upper triangle."""
+    values = corr.to_numpy()
+    rows, cols = np.triu_indices(len(corr.columns), k=1)
+    pair_values = values[rows, cols]
+    valid = ~np.isnan(pair_values)
+    rows, cols, pair_values = rows[valid], cols[valid], pair_values[valid]
+    order = np.argsort(-pair_values, kind='stable')[:n]
+    return [(corr.columns[rows[k]], corr.columns[cols[k]], pair_values[k]) for k in order]
+
+def downsample_series(x, y, max_points=LINE_PLOT_MAX_POINTS):
+    """Reduce sorted, non-null x/y series to max_points with LTTB, keeping the visual shape."""
+    if len(x) <= max_points:
+        return x, y
+    if pd.api.types.is_datetime64_any_dtype(x):
+        x_values = (x - x.iloc[0]).dt.total_seconds().to_numpy()
+    else:
+        x_values = x.to_numpy(dtype=float)
+    keep = lttb_indices(x_values, y.to_numpy(dtype=float), max_points)
+    return x.iloc[keep], y.iloc[keep]
+
+@st.cache_data(show_spinner=False)
+def generate_ai_narrative(dataset_key, _df, _corr_matrix=None):
     """
     Generate an AI-powered narrative summary based on the dataset's characteristics.
+    Pass _corr_matrix when the caller already computed it to avoid a second pass.
     """
+    df, corr_matrix = _df, _corr_matrix
     narrative = ""
     n_rows, n_cols = df.shape
     narrative += f"**Dataset Overview:**\n- The dataset contains **{n_rows}** rows and **{n_cols}** columns.\n\n"
 
     # Identify column types.
-    numeric_cols = df.select_dtypes(include=np.number).columns.tolist()
-    categorical_cols = df.select_dtypes(include='object').columns.tolist()
-    datetime_cols = df.select_dtypes(include=['datetime64[ns]', 'datetimetz']).columns.tolist()
+    column_types = classify_columns(df)
+    numeric_cols = [col for col, kind in column_types.items() if kind == 'numeric']
+    categorical_cols = [col for col, kind in column_types.items() if kind == 'categorical']
+    datetime_cols = [col for col, kind in column_types.items() if kind == 'datetime']
 
     narrative += f"**Column Types:**\n- **Numeric Columns ({len(numeric_cols)}):** {', '.join(numeric_cols) if numeric_cols else 'None'}\n"
     narrative += f"- **Categorical Columns ({len(categorical_cols)}):** {', '.join(categorical_cols) if categorical_cols else 'None'}\n"
@@ -108,22 +247,21 @@ def generate_ai_narrative(df):
 
     # Basic statistics for numeric columns.
     if numeric_cols:
-        stats = df[numeric_cols].describe().T
-        top_mean = stats['mean'].idxmax()
+        # Only the means are reported, so skip the other seven describe() statistics.
+        means = df[numeric_cols].mean()
+        top_mean = means.idxmax()
         narrative += (f"Among the numeric columns, **{top_mean}** has the highest average value of "
-                      f"**{stats.loc[top_mean, 'mean']:.2f}**.\n\n")
+                      f"**{means[top_mean]:.2f}**.\n\n")
 
     # Correlation analysis for numeric columns.
     if len(numeric_cols) > 1:
-        corr = df[numeric_cols].corr().abs()
-        corr_stack = corr.stack().reset_index()
-        corr_stack = corr_stack[corr_stack['level_0'] != corr_stack['level_1']]
-        corr_stack['pairs'] = corr_stack.apply(lambda x: tuple(sorted([x['level_0'], x['level_1']])), axis=1)
-        corr_stack = corr_stack.drop_duplicates('pairs')
-        if not corr_stack.empty:
-            highest_corr = corr_stack.loc[corr_stack[0].idxmax()]
-            narrative += (f"The strongest correlation is between **{highest_corr['level_0']}** and **{highest_corr['level_1']}** "
-                          f"with a coefficient of **{highest_corr[0]:.2f}**.\n\n")
+        if corr_matrix is None:
+            corr_matrix = correlation_matrix(dataset_key, df, numeric_cols)
+        top_pairs = top_correlated_pairs(corr_matrix, n=1)
+        if top_pairs:
+            col_x, col_y, coefficient = top_pairs[0]
+            narrative += (f"The strongest correlation is between **{col_x}** and **{col_y}** "
+                          f"with a coefficient of **{coefficient:.2f}**.\n\n")
 
     # Temporal trend analysis if a datetime and numeric column exist.
     if datetime_cols and numeric_cols:
@@ -142,78 +280,77 @@ def generate_ai_narrative(df):
 
     return narrative
 
-def generate_insights(df):
+def generate_insights(df, dataset_key):
     st.header("AI-Generated Insights")
-
-    # Improved datetime handling.
-    df = smart_datetime_conversion(df)
+    template = "plotly_dark" if st.session_state.get('dark_mode') else "plotly_white"
 
     # Univariate Analysis.
     st.subheader("📈 Key Distributions")
     cols = st.columns(3)
     color_palette = px.colors.qualitative.Plotly  # Use a qualitative palette with multiple colors.
 
-    for idx, col in enumerate(df.columns):
+    column_types = classify_columns(df)
+    for idx, (col, kind) in enumerate(column_types.items()):
         with cols[idx % 3]:
-            if pd.api.types.is_numeric_dtype(df[col]):
-                # Histogram for numeric columns.
-                fig = px.histogram(
-                    df, x=col,
-                    title=f'{col} Distribution',
-                    color_discrete_sequence=[color_palette[idx % len(color_palette)]],
-                    template="plotly_white" if not st.session_state.dark_mode else "plotly_dark"
-                )
-                fig.update_layout(xaxis_title=col, yaxis_title="Count")
+            if kind == 'numeric':
+                # Histogram for numeric columns, binned here so only the counts are sent to the browser.
+                values = df[col].to_numpy(dtype=float, na_value=np.nan)
+                counts, edges = np.histogram(values[np.isfinite(values)], bins=HISTOGRAM_BINS)
+                fig = go.Figure(go.Bar(
+                    x=0.5 * (edges[:-1] + edges[1:]), y=counts, width=np.diff(edges),
+                    marker_color=color_palette[idx % len(color_palette)]
+                ))
+                fig.update_layout(title=f'{col} Distribution', xaxis_title=col, yaxis_title="Count",
+                                  template=template)
                 st.plotly_chart(fig, use_container_width=True)
-            elif pd.api.types.is_datetime64_any_dtype(df[col]):
-                # Timeline for datetime columns.
-                df['temp_date'] = df[col].dt.date
-                counts = df['temp_date'].value_counts().sort_index()
+            elif kind == 'datetime':
+                # Timeline for datetime columns, counted per day without leaving datetime64.
+                days = df[col].dt.floor('D')
+                # groupby returns the days already in order, so no separate sort pass is needed.
+                counts = days.groupby(days).size()
+                x, y = downsample_series(counts.index.to_series(), counts)
                 fig = px.line(
-                    x=counts.index, y=counts.values,
+                    x=x, y=y,
                     title=f'{col} Timeline',
-                    markers=True,
+                    markers=len(counts) <= MARKER_MAX_POINTS,
+                    render_mode='svg' if len(counts) <= MARKER_MAX_POINTS else 'webgl',
                     color_discrete_sequence=px.colors.sequential.Viridis,
-                    template="plotly_white" if not st.session_state.dark_mode else "plotly_dark"
+                    template=template
                 )
                 fig.update_layout(xaxis_title="Date", yaxis_title="Frequency")
                 st.plotly_chart(fig, use_container_width=True)
             else:
-                # Bar chart for categorical columns.
-                counts = df[col].value_counts().nlargest(10)
-                fig = px.bar(
-                    counts,
-                    title=f'Top {col} Values',
-                    labels={'index': col, 'value': 'Count'},
-                    color=counts.index,
-                    color_discrete_sequence=px.colors.qualitative.Alphabet,
-                    template="plotly_white" if not st.session_state.dark_mode else "plotly_dark"
-                )
+                # Bar chart for categorical columns; nlargest does a partial sort, so skip the full one.
+                counts = df[col].value_counts(sort=False).nlargest(10)
+                bar_palette = px.colors.qualitative.Alphabet
+                fig = go.Figure(go.Bar(
+                    x=counts.index.astype(str), y=counts.to_numpy(),
+                    marker_color=[bar_palette[i % len(bar_palette)] for i in range(len(counts))]
+                ))
+                fig.update_layout(title=f'Top {col} Values', xaxis_title=col, yaxis_title="Count",
+                                  template=template)
                 st.plotly_chart(fig, use_container_width=True)
 
     # Correlation Analysis.
-    numeric_cols = df.select_dtypes(include=np.number).columns.tolist()
+    numeric_cols = [col for col, kind in column_types.items() if kind == 'numeric']
+    corr_matrix = None
     if len(numeric_cols) > 1:
         st.subheader("🔗 Strongest Correlations")
         try:
-            corr_matrix = df[numeric_cols].corr().abs()
-            corr_stack = corr_matrix.stack().reset_index()
-            # Remove self-correlation entries.
-            corr_stack = corr_stack[corr_stack['level_0'] != corr_stack['level_1']]
-            # Drop duplicate pairs.
-            corr_stack['pairs'] = corr_stack.apply(lambda x: tuple(sorted([x['level_0'], x['level_1']])), axis=1)
-            corr_stack = corr_stack.drop_duplicates('pairs')
-            top_corr = corr_stack.nlargest(3, 0)
-
-            for _, row in top_corr.iterrows():
-                col_x = row['level_0']
-                col_y = row['level_1']
+            corr_matrix = correlation_matrix(dataset_key, df, numeric_cols)
+            # A fixed random sample keeps the scatter plots and their trendlines light on big files.
+            scatter_df = df[numeric_cols]
+            if len(scatter_df) > SCATTER_MAX_POINTS:
+                scatter_df = scatter_df.sample(SCATTER_MAX_POINTS, random_state=0)
+            # Upper triangle only: skips self-correlations and mirrored duplicates.
+            for col_x, col_y, _ in top_correlated_pairs(corr_matrix, n=3):
                 fig = px.scatter(
-                    df, x=col_x, y=col_y,
+                    scatter_df, x=col_x, y=col_y,
                     trendline='ols',
                     title=f"{col_x} vs {col_y}",
+                    render_mode='svg' if len(scatter_df) <= MARKER_MAX_POINTS else 'webgl',
                     color_discrete_sequence=px.colors.qualitative.Set1,
-                    template="plotly_white" if not st.session_state.dark_mode else "plotly_dark"
+                    template=template
                 )
                 fig.update_traces(marker=dict(size=8))
                 st.plotly_chart(fig, use_container_width=True)
@@ -221,21 +358,24 @@ def generate_insights(df):
             st.warning(f"Couldn't calculate correlations: {str(e)}")
 
     # Temporal Analysis.
-    date_cols = df.select_dtypes(include=['datetime', 'datetimetz']).columns.tolist()
+    date_cols = [col for col, kind in column_types.items() if kind == 'datetime']
     if date_cols:
         st.subheader("⏳ Temporal Trends")
         date_col = date_cols[0]
-        # Choose the first available numeric column different from the date column.
-        numeric_col = next((col for col in numeric_cols if col != date_col), None)
+        # A datetime column is never numeric, so the first numeric column can be used directly.
+        numeric_col = numeric_cols[0] if numeric_cols else None
 
         if numeric_col:
             try:
+                trend = df[[date_col, numeric_col]].dropna().sort_values(date_col)
+                x, y = downsample_series(trend[date_col], trend[numeric_col])
                 fig = px.line(
-                    df, x=date_col, y=numeric_col,
+                    x=x, y=y,
                     title=f'{numeric_col} Over Time',
-                    markers=True,
+                    markers=len(trend) <= MARKER_MAX_POINTS,
+                    render_mode='svg' if len(trend) <= MARKER_MAX_POINTS else 'webgl',
                     color_discrete_sequence=px.colors.sequential.Plasma,
-                    template="plotly_white" if not st.session_state.dark_mode else "plotly_dark"
+                    template=template
                 )
                 fig.update_layout(xaxis_title="Date", yaxis_title=numeric_col)
                 st.plotly_chart(fig, use_container_width=True)
@@ -244,9 +384,36 @@ def generate_insights(df):
 
     # AI-Powered Narrative Summary.
     st.subheader("🤖 AI Narrative")
-    narrative = generate_ai_narrative(df)
+    narrative = generate_ai_narrative(dataset_key, df, corr_matrix)
     st.markdown(narrative)
 
+def render_dashboard(df, dataset_key):
+    """Preview and analyse a prepared dataset."""
+    st.subheader("Dataset Preview")
+    with st.expander("View First 10 Rows"):
+        st.dataframe(df.head(10), use_container_width=True)
+
+    generate_insights(df, dataset_key)
+
+def confirm_full_analysis(uploaded_file):
+    """Preview a large upload cheaply and only analyse it once the user asks to."""
+    file_id = uploaded_file.file_id
+    if uploaded_file.size <= LARGE_FILE_BYTES or st.session_state.get('full_analysis_file') == file_id:
+        return True
+
+    # Parse only complete lines from the head of the file, with the same reader as the full load.
+    head = uploaded_file.read(PREVIEW_BYTES)
+    uploaded_file.seek(0)
+    preview_df = read_csv_bytes(head[:head.rfind(b'\n') + 1] or head).head(PREVIEW_ROWS)
+    st.subheader("Dataset Preview")
+    st.dataframe(preview_df, use_container_width=True)
+    st.info(f"This file is {uploaded_file.size / 1024 ** 2:.0f} MB, so only the first rows are shown.")
+    if st.button("Run full analysis"):
+        st.session_state.full_analysis_file = file_id
+        # Start over so the preview above is replaced rather than shown next to the dashboard.
+        st.rerun()
+    return False
+
 def main():
     st.set_page_config(page_title="AI Data Visualizer", layout="wide")
 
@@ -260,8 +427,7 @@ def main():
         return
 
     # Sidebar controls for logged-in users.
-    set_custom_style()
-    st.sidebar.checkbox("Dark Mode", value=st.session_state.dark_mode, key="dark_mode")
+    theme_controls()
     if st.sidebar.button("Logout"):
         st.session_state.logged_in = False
         # If st.experimental_rerun exists, call it; otherwise, instruct the user to refresh.
@@ -276,14 +442,12 @@ def main():
 
     if uploaded_file:
         try:
-            df = pd.read_csv(uploaded_file)
-            df = smart_datetime_conversion(df)
-
-            st.subheader("Dataset Preview")
-            with st.expander("View First 10 Rows"):
-                st.dataframe(df.head(10), use_container_width=True)
+            if not confirm_full_analysis(uploaded_file):
+                return
 
-            generate_insights(df)
+            # Cached per upload so reruns skip parsing and datetime detection.
+            df = load_and_prepare(uploaded_file.file_id, uploaded_file)
+            render_dashboard(df, uploaded_file.file_id)
 
         except Exception as e:
             st.error(f"Error processing file: {str(e)}")
@@ -1,5 +1,7 @@
 import sqlite3
 import os
+import hashlib
+import threading
 from werkzeug.security import generate_password_hash, check_password_hash
 
 # Use home directory for data storage
@@ -7,57 +9,91 @@ HOME_DIR = os.path.expanduser('~')
 DATA_DIR = os.path.join(HOME_DIR, '.streamlit_app_data')
 DB_PATH = os.path.join(DATA_DIR, 'users.db')
 
+# Statements are kept identical so SQLite's per-connection statement cache reuses them.
+_INSERT_USER = "INSERT INTO users VALUES (?, ?)"
+_SELECT_PASSWORD = "SELECT password FROM users WHERE username=?"
+
+# Successful logins remembered in this process so repeat logins skip the password KDF.
+VERIFIED_CACHE_SIZE = 1024
+
+# One connection shared by all Streamlit sessions; the lock serializes access to it.
+_conn = None
+_lock = threading.Lock()
+_verified_logins = set()
+# Per-process salt so the login cache never holds a plain password digest.
+_cache_salt = os.urandom(16)
+
+def _get_connection():
+    """Open the shared connection on first use (call with _lock held)."""
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+    return _conn
+
 def init_db():
     try:
         # Create data directory if it doesn't exist
         os.makedirs(DATA_DIR, exist_ok=True)
-        
+
         # Set proper permissions
         os.chmod(DATA_DIR, 0o755)
-        
-        # Create or connect to database
-        conn = sqlite3.connect(DB_PATH)
-        
-        # Set proper permissions for the database file
-        if os.path.exists(DB_PATH):
-            os.chmod(DB_PATH, 0o644)
-            
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS users
-                     (username TEXT PRIMARY KEY, password TEXT)''')
-        conn.commit()
-        conn.close()
-        
+
+        with _lock:
+            # Create or connect to database
+            conn = _get_connection()
+
+            # Set proper permissions for the database file
+            if os.path.exists(DB_PATH):
+                os.chmod(DB_PATH, 0o644)
+
+            conn.execute('''CREATE TABLE IF NOT EXISTS users
+                         (username TEXT PRIMARY KEY, password TEXT)''')
+            conn.commit()
+
         # Ensure the database file has correct permissions
         os.chmod(DB_PATH, 0o644)
-        
+
     except Exception as e:
         print(f"Database initialization error: {str(e)}")
         raise
 
 def add_user(username, password):
+    # Hash outside the lock; the KDF is the slow part.
+    hashed_password = generate_password_hash(password)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        hashed_password = generate_password_hash(password)
-        c.execute("INSERT INTO users VALUES (?, ?)", (username, hashed_password))
-        conn.commit()
+        # The connection context commits on success and rolls back on error.
+        with _lock, _get_connection() as conn:
+            conn.execute(_INSERT_USER, (username, hashed_password))
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+def add_users(pairs):
+    """Register many (username, password) pairs in one transaction; all or none are added."""
+    rows = [(username, generate_password_hash(password)) for username, password in pairs]
+    try:
+        with _lock, _get_connection() as conn:
+            conn.executemany(_INSERT_USER, rows)
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 def verify_user(username, password):
+    login_key = (username, hashlib.sha256(_cache_salt + password.encode()).hexdigest())
+    if login_key in _verified_logins:
+        return True
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT password FROM users WHERE username=?", (username,))
-        result = c.fetchone()
-        conn.close()
-        
-        if result:
-            return check_password_hash(result[0], password)
+        with _lock:
+            result = _get_connection().execute(_SELECT_PASSWORD, (username,)).fetchone()
+
+        if result and check_password_hash(result[0], password):
+            # Only successful logins are cached, so a later registration is never masked.
+            if len(_verified_logins) >= VERIFIED_CACHE_SIZE:
+                _verified_logins.clear()
+            _verified_logins.add(login_key)
+            return True
         return False
     except Exception:
-        return False 
+        return False
@@ -0,0 +1,46 @@
+import numpy as np
+
+# Optional JIT compiler for the LTTB kernel; plain numpy is used without it.
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+def _lttb_kernel(x, y, threshold):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    bucket_size = (n - 2) / (threshold - 2)
+    anchor = 0
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        # Average of the next bucket is the third vertex of each candidate triangle.
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        areas = np.abs((x[anchor] - avg_x) * (y[start:end] - y[anchor])
+                       - (x[anchor] - x[start:end]) * (avg_y - y[anchor]))
+        anchor = start + int(np.argmax(areas))
+        indices[i + 1] = anchor
+    return indices
+
+# Streamlit re-executes app.py on every rerun but imports this module once per process,
+# so the kernel is compiled here exactly once.
+if njit is not None:
+    _lttb_kernel = njit(cache=True)(_lttb_kernel)
+
+def lttb_indices(x, y, threshold):
+    """Indices of the points kept by Largest-Triangle-Three-Buckets downsampling."""
+    # Copy-on-write pandas hands out read-only views; always passing writable contiguous
+    # float64 arrays keeps numba to the single specialization compiled below.
+    x = np.require(x, np.float64, ['C', 'W'])
+    y = np.require(y, np.float64, ['C', 'W'])
+    return _lttb_kernel(x, y, int(threshold))
+
+if njit is not None:
+    # Compile now so the first upload does not pay for it.
+    lttb_indices(np.arange(4.0), np.arange(4.0), 3)